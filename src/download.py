@@ -2,16 +2,29 @@
 
 import os
 import sys
+import ctypes
+import mmap
 import hashlib
+import json
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from pathlib import Path
+import shutil
 import subprocess
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 import logging
 import time
 import signal
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from datetime import datetime
 
+try:
+    import blake3
+except ImportError:  # only needed for blake3: hashes in models.txt
+    blake3 = None
+
 # Set up logging
 logging.basicConfig(
     level=logging.INFO,
@@ -19,135 +32,542 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Shared HTTP session so connections (and TLS handshakes) are reused across requests and threads
+_SESSION = requests.Session()
+_SESSION.headers['User-Agent'] = 'runpod-pod-downloader'
+_ADAPTER = HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=32,
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504])
+)
+_SESSION.mount('https://', _ADAPTER)
+_SESSION.mount('http://', _ADAPTER)
+
+# Hash algorithms accepted as a prefix in the models.txt hash column; unprefixed hashes are sha256
+HASH_ALGORITHMS = ('sha256', 'blake3')
+
+# Read size for streamed downloads
+BLOCK_SIZE = 1 << 20
+
+# Bytes handed to a single hash update when verifying files on disk
+HASH_SLICE_SIZE = 256 << 20
+
+# Log download progress every this many bytes
+PROGRESS_INTERVAL = 64 << 20
+PROGRESS_BAR_LENGTH = 30
+PROGRESS_BAR_FILLED = '=' * PROGRESS_BAR_LENGTH
+PROGRESS_BAR_EMPTY = '-' * PROGRESS_BAR_LENGTH
+
+# Existing files are fully hashed one at a time, alongside downloads
+VERIFY_WORKERS = 1
+
+# Files with at least this many bytes left are fetched over several parallel range requests
+PARALLEL_MIN_SIZE = 64 << 20
+SEGMENT_COUNT = 4
+
+# Suffix of the sidecar next to a file recording per-segment progress of a segmented download
+SEGMENTS_SUFFIX = '.segments'
+
+# Sidecar in the cache directory recording files whose hash was already verified
+VERIFIED_CACHE_FILE = '.verified.json'
+
+# fallocate(2) from libc, used to reserve disk space ahead of streaming writes (Linux only)
+FALLOC_FL_KEEP_SIZE = 0x01
+try:
+    _fallocate = ctypes.CDLL(None, use_errno=True).fallocate
+    _fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_int64, ctypes.c_int64]
+except (OSError, AttributeError, TypeError):
+    _fallocate = None
+
+def preallocate(fd: int, offset: int, length: int):
+    """Reserve disk space for a file without changing its reported size."""
+    # KEEP_SIZE so an interrupted download still reports only the bytes actually written,
+    # which is what resume relies on (os.posix_fallocate would extend the file)
+    if _fallocate is None or length <= 0:
+        return
+    if _fallocate(fd, FALLOC_FL_KEEP_SIZE, offset, length) != 0:
+        logger.debug(f"fallocate failed: {os.strerror(ctypes.get_errno())}")
+
+def write_all(fd: int, data: bytes, offset: Optional[int] = None):
+    """Write all of data to a raw file descriptor (at offset, if given), retrying on short writes."""
+    view = memoryview(data)
+    while view:
+        if offset is None:
+            written = os.write(fd, view)
+        else:
+            written = os.pwrite(fd, view, offset)
+            offset += written
+        view = view[written:]
+
 def clone_comfyui() -> List[str]:
     """Clone ComfyUI repo and return list of model folder names."""
-    if not os.path.exists("ComfyUI"):
+    if not os.path.exists("ComfyUI/models"):
         logger.info("Cloning ComfyUI repository...")
-        subprocess.run(["git", "clone", "https://github.com/comfyanonymous/ComfyUI.git"], check=True)
+        # Shallow, blobless, sparse clone: only the models/ tree is checked out. This takes
+        # several git commands, so clone into a temporary directory and only move it into
+        # place once checkout succeeds; a half-finished clone would otherwise stick around
+        tmp_path = "ComfyUI.tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        try:
+            subprocess.run(["git", "clone", "--depth=1", "--filter=blob:none", "--no-checkout",
+                            "https://github.com/comfyanonymous/ComfyUI.git", tmp_path], check=True)
+            subprocess.run(["git", "-C", tmp_path, "sparse-checkout", "init", "--cone"], check=True)
+            subprocess.run(["git", "-C", tmp_path, "sparse-checkout", "set", "models"], check=True)
+            subprocess.run(["git", "-C", tmp_path, "checkout"], check=True)
+        except BaseException:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        # Replace any leftover ComfyUI directory without a models/ folder
+        shutil.rmtree("ComfyUI", ignore_errors=True)
+        os.replace(tmp_path, "ComfyUI")
     
     models_path = Path("ComfyUI/models")
     if not models_path.exists():
         raise RuntimeError("Models directory not found in ComfyUI repository")
     
     # Get folder names and filter out hidden folders
-    model_folders = [f.name for f in models_path.iterdir() if f.is_dir() and not f.name.startswith('.')]
+    with os.scandir(models_path) as entries:
+        model_folders = [e.name for e in entries if e.is_dir(follow_symlinks=False) and not e.name.startswith('.')]
     logger.info(f"Found model folders: {', '.join(model_folders)}")
     return model_folders
 
-def verify_hash(file_path: str, expected_hash: str) -> bool:
-    """Verify SHA256 hash of downloaded file."""
-    sha256_hash = hashlib.sha256()
+def parse_hash(expected_hash: str) -> Tuple[str, str]:
+    """Split a models.txt hash value into (algorithm, lowercase hex digest)."""
+    algorithm, sep, digest = expected_hash.rpartition(':')
+    if not sep:
+        algorithm = 'sha256'
+    algorithm = algorithm.lower()
+    if algorithm not in HASH_ALGORITHMS:
+        raise ValueError(f"Unsupported hash algorithm: {algorithm}")
+    return algorithm, digest.lower()
+
+def new_hasher(algorithm: str):
+    """Return an empty hash object for the given algorithm."""
+    if algorithm == 'blake3':
+        if blake3 is None:
+            raise RuntimeError("blake3 hashes require the blake3 package (pip install blake3)")
+        return blake3.blake3(max_threads=blake3.blake3.AUTO)
+    return hashlib.sha256()
+
+def update_hash_from_file(file_hash, file_path: str, start: int = 0, end: Optional[int] = None):
+    """Feed bytes [start, end) of a file (through to its end if end is None) into a hash object."""
     with open(file_path, "rb") as f:
-        for byte_block in iter(lambda: f.read(4096), b""):
-            sha256_hash.update(byte_block)
-    
-    actual_hash = sha256_hash.hexdigest()
-    return actual_hash.lower() == expected_hash.lower()
-
-def download_file(url: str, destination: str):
-    """Download file with progress indication and resume support."""
-    # Check if file exists and get its size
-    file_size = 0
-    mode = 'wb'
-    if os.path.exists(destination):
-        file_size = os.path.getsize(destination)
-        mode = 'ab'
-
-    # First make a HEAD request to get the total size
-    head = requests.head(url)
-    total_size = int(head.headers.get('content-length', 0))
-
-    # If we already have the complete file, no need to download
-    if file_size == total_size and total_size > 0:
-        logger.info("File is already complete. No need to resume.")
+        if end is None:
+            end = os.fstat(f.fileno()).st_size
+        # mmap can't map an empty file
+        if end <= start:
+            return file_hash
+        # Hash straight out of the page cache, in large slices to bound resident memory
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(mm) as view:
+                for offset in range(start, end, HASH_SLICE_SIZE):
+                    # Have the kernel start reading the next slice while we hash this one
+                    next_offset = min(offset + HASH_SLICE_SIZE, end)
+                    if hasattr(mmap, 'MADV_WILLNEED') and next_offset < end:
+                        page_offset = next_offset - next_offset % mmap.PAGESIZE
+                        length = min(HASH_SLICE_SIZE, end - next_offset) + next_offset - page_offset
+                        mm.madvise(mmap.MADV_WILLNEED, page_offset, length)
+                    file_hash.update(view[offset:next_offset])
+    return file_hash
+
+def hash_file(file_path: str, algorithm: str = 'sha256'):
+    """Return a hash object fed with the full contents of a file."""
+    file_hash = new_hasher(algorithm)
+    if algorithm == 'blake3':
+        # blake3 maps the file itself and hashes it across threads
+        file_hash.update_mmap(file_path)
+        return file_hash
+    return update_hash_from_file(file_hash, file_path)
+
+def verify_hash(file_path: str, expected_hash: str) -> bool:
+    """Verify hash of downloaded file (sha256, or the algorithm named by its prefix)."""
+    algorithm, digest = parse_hash(expected_hash)
+    actual_hash = hash_file(file_path, algorithm).hexdigest()
+    return actual_hash.lower() == digest
+
+def load_verified(cache_path: Path) -> dict:
+    """Load the verified-files sidecar, or an empty mapping if missing or unreadable."""
+    try:
+        with open(cache_path / VERIFIED_CACHE_FILE, 'r') as f:
+            verified = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable {VERIFIED_CACHE_FILE}: {e}")
+        return {}
+    return verified if isinstance(verified, dict) else {}
+
+def save_verified(cache_path: Path, verified: dict):
+    """Atomically write the verified-files sidecar."""
+    tmp_path = cache_path / f"{VERIFIED_CACHE_FILE}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(verified, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, cache_path / VERIFIED_CACHE_FILE)
+
+def is_verified(entry: Optional[dict], stat: os.stat_result, expected_hash: str) -> bool:
+    """Check whether a sidecar entry still vouches for a file with the given stat and hash."""
+    return (isinstance(entry, dict)
+            and entry.get('size') == stat.st_size
+            and entry.get('mtime_ns') == stat.st_mtime_ns
+            and str(entry.get('hash', '')).lower() == expected_hash.lower())
+
+def verified_entry(file_path: Path, expected_hash: str) -> dict:
+    """Build a sidecar entry for a file whose hash was just verified."""
+    stat = file_path.stat()
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'hash': expected_hash.lower(), 'ts': time.time()}
+
+def iter_body(response: requests.Response, limit: Optional[int] = None):
+    """Yield the body of a streamed response in BLOCK_SIZE chunks, stopping after limit bytes if given."""
+    remaining = limit
+    encoding = response.headers.get('content-encoding', 'identity').lower()
+    if encoding != 'identity':
+        for data in response.iter_content(chunk_size=BLOCK_SIZE):
+            if remaining is not None:
+                data = data[:remaining]
+                remaining -= len(data)
+            yield data
+            if remaining == 0:
+                return
         return
+    # Nothing to decode, so read the raw stream directly and skip urllib3's decoder pipeline
+    read = response.raw.read
+    while remaining is None or remaining > 0:
+        data = read(BLOCK_SIZE if remaining is None else min(BLOCK_SIZE, remaining), decode_content=False)
+        if not data:
+            return
+        if remaining is not None:
+            remaining -= len(data)
+        yield data
+
+def content_range_total(response: requests.Response) -> int:
+    """Get the total file size from a 206 response's Content-Range header."""
+    return int(response.headers.get('content-range').split('/')[-1])
+
+def segments_path(destination: str) -> str:
+    """Get the path of the sidecar tracking an unfinished segmented download."""
+    return f"{destination}{SEGMENTS_SUFFIX}"
+
+def load_segments(destination: str) -> Optional[dict]:
+    """Load the progress of an interrupted segmented download, or None if there isn't one."""
+    try:
+        with open(segments_path(destination), 'r') as f:
+            state = json.load(f)
+        total_size = state['total_size']
+        segments = state['segments']
+        if not (isinstance(total_size, int) and segments
+                and all(len(seg) == 3 and all(isinstance(v, int) for v in seg) and seg[0] <= seg[1] <= seg[2]
+                        for seg in segments)):
+            raise ValueError("malformed segment list")
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logger.warning(f"Ignoring unreadable {segments_path(destination)}: {e}")
+        return None
+    return state
+
+def save_segments(destination: str, state: dict):
+    """Atomically write the progress of a segmented download."""
+    tmp_path = f"{segments_path(destination)}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, segments_path(destination))
+
+def remove_segments(destination: str):
+    """Delete the segmented download sidecar, if any."""
+    try:
+        os.remove(segments_path(destination))
+    except FileNotFoundError:
+        pass
+
+def plan_segments(start: int, total_size: int) -> dict:
+    """Split bytes [start, total_size) into SEGMENT_COUNT segments of [lo, done, hi) offsets."""
+    step = -(-(total_size - start) // SEGMENT_COUNT)
+    segments = [[lo, lo, min(lo + step, total_size)] for lo in range(start, total_size, step)]
+    return {'total_size': total_size, 'segments': segments}
+
+def log_progress(name: str, downloaded: int, total_size: int, resumed_from: int, start_time: float):
+    """Log a progress line for a download."""
+    elapsed_time = time.time() - start_time
+    # Calculate speed based on new data downloaded, not total file size
+    download_speed = (downloaded - resumed_from) / elapsed_time if elapsed_time > 0 else 0
+
+    # Calculate ETA
+    if download_speed > 0:
+        eta_seconds = (total_size - downloaded) / download_speed
+        eta_str = time.strftime('%M:%S', time.gmtime(eta_seconds))
+    else:
+        eta_str = '--:--'
+
+    # Integer percentage and bar fill, sliced from prebuilt strings
+    percent = downloaded * 100 // total_size
+    filled_length = downloaded * PROGRESS_BAR_LENGTH // total_size
+    bar = PROGRESS_BAR_FILLED[:filled_length] + PROGRESS_BAR_EMPTY[filled_length:]
+
+    # Log progress (one line per file, so parallel downloads don't interleave)
+    logger.info(f'{name}: [{bar}] {percent:3d}% | '
+                f'{downloaded >> 20}/{total_size >> 20} MiB | '
+                f'{download_speed / (1 << 20):.1f} MiB/s | ETA: {eta_str}')
+
+def download_file(url: str, destination: str, algorithm: str = 'sha256') -> str:
+    """Download file with progress indication and resume support.
+
+    Returns the hex digest of the complete file using the given hash algorithm.
+    """
+    name = os.path.basename(destination)
+
+    # An interrupted segmented download has holes, so its file size means nothing;
+    # resume from the per-segment progress recorded next to it instead
+    state = load_segments(destination)
+    if state is not None and not os.path.exists(destination):
+        remove_segments(destination)
+        state = None
+    if state is not None:
+        pending = [seg for seg in state['segments'] if seg[1] < seg[2]]
+        if not pending:
+            # Everything was written; only the hash remains
+            return download_segments(url, destination, algorithm, state)
+        file_size = pending[0][1]
+    else:
+        # Check if file exists and get its size (one stat call)
+        try:
+            file_size = os.stat(destination).st_size
+        except FileNotFoundError:
+            file_size = 0
 
-    # Prepare headers for range request
-    headers = {}
+    # Single GET; always ranged so a 206 tells us the server supports range requests,
+    # and Content-Range gives us the total size
+    headers = {'Range': f'bytes={file_size}-'}
     if file_size > 0:
-        headers['Range'] = f'bytes={file_size}-'
-        logger.info(f"Resuming download from byte {file_size}")
+        logger.info(f"{name}: Resuming download from byte {file_size}")
+
+    response = _SESSION.get(url, stream=True, headers=headers)
 
-    response = requests.get(url, stream=True, headers=headers)
+    if state is not None:
+        if response.status_code == 206 and content_range_total(response) == state['total_size']:
+            return download_segments(url, destination, algorithm, state, response)
+        response.close()
+        if response.status_code not in (200, 206, 416):
+            # Transient or auth failure (5xx, 429, expired URL...): keep the partial
+            # download and its sidecar so the next cycle can still resume
+            response.raise_for_status()
+            raise RuntimeError(f"{name}: Unexpected HTTP {response.status_code} when resuming download")
+        # Remote file changed (or lost range support) since the interrupted download, start over
+        logger.warning(f"{name}: Remote file changed since the interrupted download, restarting")
+        remove_segments(destination)
+        os.truncate(destination, 0)
+        return download_file(url, destination, algorithm)
     
     # Handle different response codes
-    if response.status_code == 206:  # Partial content
-        total_size = int(response.headers.get('content-range').split('/')[-1])
+    if response.status_code == 416:  # Range not satisfiable
+        total_size = int(response.headers.get('content-range', '*/0').split('/')[-1] or 0)
+        response.close()
+        # If we already have the complete file, no need to download
+        if file_size == total_size:
+            if total_size == 0:
+                # Empty remote file: nothing to fetch, just make sure it exists locally
+                open(destination, 'wb').close()
+                return new_hasher(algorithm).hexdigest()
+            logger.info(f"{name}: File is already complete. No need to resume.")
+            return hash_file(destination, algorithm).hexdigest()
+        # Local file is larger than the remote one, start from beginning
+        logger.warning(f"{name}: Existing file is larger than remote ({file_size} > {total_size}), restarting download")
+        response = _SESSION.get(url, stream=True)
+        response.raise_for_status()
+        total_size = int(response.headers.get('content-length', 0))
+        file_size = 0
+    elif response.status_code == 206:  # Partial content
+        total_size = content_range_total(response)
     elif response.status_code == 200:  # Full content
         total_size = int(response.headers.get('content-length', 0))
         # If we got a 200 when trying to resume, server doesn't support range requests
         # Start from beginning
         file_size = 0
-        mode = 'wb'
     else:
         response.raise_for_status()
 
-    block_size = 8192
+    # Large files: split what's left across several connections, the first one
+    # continuing on the response we already have open
+    if (response.status_code == 206 and hasattr(os, 'pwrite')
+            and response.headers.get('content-encoding', 'identity').lower() == 'identity'
+            and total_size - file_size >= PARALLEL_MIN_SIZE):
+        return download_segments(url, destination, algorithm, plan_segments(file_size, total_size), response)
+
+    # Hash while streaming; on resume, seed with the bytes already on disk
+    file_hash = hash_file(destination, algorithm) if file_size > 0 else new_hasher(algorithm)
+
     downloaded = file_size  # Start count from existing file size
     start_time = time.time()
-    last_update_time = start_time
+    last_shown = downloaded
     
-    with open(destination, mode) as f:
-        for data in response.iter_content(block_size):
+    # Raw fd instead of a buffered file object: chunks are already large, so stdio
+    # buffering would only add an extra copy. Truncate unless resuming.
+    fd = os.open(destination, os.O_WRONLY | os.O_CREAT | (0 if file_size > 0 else os.O_TRUNC), 0o644)
+    try:
+        os.lseek(fd, file_size, os.SEEK_SET)
+        if total_size > file_size:
+            preallocate(fd, file_size, total_size - file_size)
+        for data in iter_body(response):
             downloaded += len(data)
-            f.write(data)
+            file_hash.update(data)
+            write_all(fd, data)
             
-            current_time = time.time()
-            # Only update progress every 2 seconds
-            if total_size > 0 and (current_time - last_update_time) >= 2:
-                elapsed_time = current_time - start_time
-                # Calculate speed based on new data downloaded, not total file size
-                download_speed = (downloaded - file_size) / elapsed_time if elapsed_time > 0 else 0
-                
-                # Calculate ETA
-                if download_speed > 0:
-                    eta_seconds = (total_size - downloaded) / download_speed
-                    eta_str = time.strftime('%M:%S', time.gmtime(eta_seconds))
-                else:
-                    eta_str = '--:--'
-                
-                # Calculate progress percentage and downloaded size in MB
-                percent = (downloaded * 100) / total_size
-                downloaded_mb = downloaded / (1024 * 1024)
-                total_mb = total_size / (1024 * 1024)
-                speed_mb = download_speed / (1024 * 1024)
-                
-                # Create progress bar
-                bar_length = 30
-                filled_length = int(bar_length * downloaded / total_size)
-                bar = '=' * filled_length + '-' * (bar_length - filled_length)
-                
-                # Print progress
-                print(f'\rDownloading: [{bar}] {percent:5.1f}% | '
-                      f'{downloaded_mb:.1f}/{total_mb:.1f} MB | '
-                      f'{speed_mb:.1f} MB/s | ETA: {eta_str}', 
-                      end='', flush=True)
-                
-                last_update_time = current_time
+            # Only update progress every PROGRESS_INTERVAL bytes
+            if downloaded - last_shown >= PROGRESS_INTERVAL and total_size > 0:
+                log_progress(name, downloaded, total_size, file_size, start_time)
+                last_shown = downloaded
+
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+        response.close()
     
-    # Print newline after completion
     if total_size > 0:
-        print()
         # Print final stats
         elapsed_time = time.time() - start_time
         if elapsed_time > 0:
             final_speed = (downloaded - file_size) / (1024 * 1024) / elapsed_time
-            logger.info(f"Download completed: {downloaded/(1024*1024):.1f}MB in {elapsed_time:.1f}s ({final_speed:.1f}MB/s)")
+            logger.info(f"{name}: Download completed: {downloaded/(1024*1024):.1f}MB in {elapsed_time:.1f}s ({final_speed:.1f}MB/s)")
 
-def parse_models_file(file_path: str) -> List[Tuple[str, str, str, str]]:
-    """Parse models.txt file into list of (type, url, filename, hash) tuples."""
-    models = []
-    with open(file_path, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if not line or line.startswith('#'):
-                continue
+    return file_hash.hexdigest()
+
+def download_segments(url: str, destination: str, algorithm: str, state: dict,
+                      first_response: Optional[requests.Response] = None) -> str:
+    """Download the unfinished segments of a file over parallel range requests.
+
+    first_response, if given, is an open ranged response starting at the first
+    unfinished segment's offset. Progress is saved to a sidecar as segments advance,
+    so a killed process resumes each segment where it stopped.
+    Returns the hex digest of the complete file using the given hash algorithm.
+    """
+    name = os.path.basename(destination)
+    total_size = state['total_size']
+    segments = state['segments']
+    pending = [index for index, (lo, done, hi) in enumerate(segments) if done < hi]
+    if pending:
+        logger.info(f"{name}: Downloading {sum(hi - done for lo, done, hi in segments)} bytes "
+                    f"in {len(pending)} segments")
+
+    file_hash = new_hasher(algorithm)
+    lock = threading.Lock()
+    abort = threading.Event()
+    downloaded = segments[0][0] + sum(done - lo for lo, done, hi in segments)
+    resumed_from = downloaded
+    start_time = time.time()
+    last_shown = downloaded
+
+    def fetch_segment(index: int, response: Optional[requests.Response]):
+        nonlocal downloaded, last_shown
+        lo, offset, hi = segments[index]
+        try:
+            if index == 0:
+                # The first segment is hashed as it streams, after whatever precedes it on disk
+                update_hash_from_file(file_hash, destination, 0, offset)
+            if offset == hi:
+                return
+            if response is None:
+                response = _SESSION.get(url, stream=True, headers={'Range': f'bytes={offset}-{hi - 1}'})
+            with response:
+                if response.status_code != 206:
+                    response.raise_for_status()
+                    raise RuntimeError(f"Server ignored range request for {name}")
+                if content_range_total(response) != total_size:
+                    raise RuntimeError(f"Remote size of {name} changed during download")
+                for data in iter_body(response, hi - offset):
+                    # Another segment failed, stop instead of fetching bytes that will be retried anyway
+                    if abort.is_set():
+                        return
+                    write_all(fd, data, offset)
+                    if index == 0:
+                        file_hash.update(data)
+                    offset += len(data)
+                    with lock:
+                        segments[index][1] = offset
+                        downloaded += len(data)
+                        # Only update progress (and the resume sidecar) every PROGRESS_INTERVAL bytes
+                        if downloaded - last_shown >= PROGRESS_INTERVAL:
+                            log_progress(name, downloaded, total_size, resumed_from, start_time)
+                            save_segments(destination, state)
+                            last_shown = downloaded
+            if offset != hi:
+                raise RuntimeError(f"Incomplete segment {lo}-{hi - 1} for {name}")
+        except BaseException:
+            abort.set()
+            raise
+
+    # Never truncate unless starting from nothing: earlier bytes and segments are already on disk
+    fd = os.open(destination, os.O_WRONLY | os.O_CREAT | (os.O_TRUNC if downloaded == 0 else 0), 0o644)
+    try:
+        preallocate(fd, segments[0][0], total_size - segments[0][0])
+        save_segments(destination, state)
+        with ThreadPoolExecutor(max_workers=len(segments)) as executor:
+            futures = [executor.submit(fetch_segment, index,
+                                       first_response if pending and index == pending[0] else None)
+                       for index in range(len(segments))]
             try:
-                model_type, url, filename, hash_value = line.split()
-                models.append((model_type, url, filename, hash_value))
-            except ValueError:
-                logger.error(f"Invalid line format: {line}")
-                raise ValueError(f"Each line must contain exactly four space-separated values: {line}")
+                for index, future in enumerate(futures):
+                    future.result()
+                    if abort.is_set():
+                        break
+                    if index > 0:
+                        # Hash later segments in order as they land, while the rest keep downloading
+                        lo, done, hi = segments[index]
+                        update_hash_from_file(file_hash, destination, lo, hi)
+            except BaseException:
+                abort.set()
+                raise
+        # A later segment failed while we were waiting on an earlier one
+        for future in futures:
+            if future.exception() is not None:
+                raise future.exception()
+        os.fsync(fd)
+    except BaseException:
+        # Record exactly how far each segment got, so the next attempt resumes from there
+        save_segments(destination, state)
+        raise
+    finally:
+        os.close(fd)
+        if first_response is not None:
+            first_response.close()
+    remove_segments(destination)
+
+    elapsed_time = time.time() - start_time
+    if pending and elapsed_time > 0:
+        final_speed = (total_size - resumed_from) / (1024 * 1024) / elapsed_time
+        logger.info(f"{name}: Download completed: {total_size/(1024*1024):.1f}MB in {elapsed_time:.1f}s ({final_speed:.1f}MB/s)")
+
+    return file_hash.hexdigest()
+
+def parse_models_file(file_path: str) -> List[Tuple[str, str, str, str, Optional[int]]]:
+    """Parse models.txt file into list of (type, url, filename, hash, size) tuples.
+
+    The size column is optional and is None when omitted.
+    """
+    models = []
+    invalid_lines = []
+    for line in Path(file_path).read_text().splitlines():
+        fields = line.split()
+        if not fields or fields[0].startswith('#'):
+            continue
+        if len(fields) not in (4, 5) or (len(fields) == 5 and not fields[4].isdigit()):
+            invalid_lines.append(line.strip())
+            continue
+        try:
+            parse_hash(fields[3])
+        except ValueError:
+            invalid_lines.append(line.strip())
+            continue
+        size = int(fields[4]) if len(fields) == 5 else None
+        models.append((*fields[:4], size))
+
+    # Report every bad line at once rather than stopping at the first
+    if invalid_lines:
+        for line in invalid_lines:
+            logger.error(f"Invalid line format: {line}")
+        raise ValueError(f"Each line must contain four space-separated values (hash optionally prefixed with "
+                         f"{' or '.join(a + ':' for a in HASH_ALGORITHMS)}) and an optional size in bytes: "
+                         f"{'; '.join(invalid_lines)}")
     return models
 
 def get_folder_name(model_type: str, comfy_folders: List[str]) -> str:
@@ -157,6 +577,70 @@ def get_folder_name(model_type: str, comfy_folders: List[str]) -> str:
         return f"{model_type}s"
     return model_type
 
+def get_model_path(model_type: str, filename: str, cache_path: Path, comfy_folders: List[str]) -> Path:
+    """Get the destination path for a model, creating its type-specific folder."""
+    # Get correct folder name (handling singular/plural)
+    folder_name = get_folder_name(model_type, comfy_folders)
+    
+    # Create type-specific subdirectory
+    model_dir = cache_path / folder_name
+    model_dir.mkdir(exist_ok=True)
+    
+    return model_dir / filename
+
+def check_existing(file_path: Path, expected_hash: str, expected_size: Optional[int], verified: dict) -> Optional[bool]:
+    """Run the cheap (stat-only) checks on a model file.
+
+    Returns True if the file is known good, False if it must be downloaded,
+    or None if it exists and needs a full hash to tell.
+    """
+    try:
+        stat = file_path.stat()
+    except FileNotFoundError:
+        return False
+
+    logger.info(f"File already exists: {file_path}")
+    if os.path.exists(segments_path(str(file_path))):
+        logger.info(f"Resuming interrupted segmented download: {file_path.name}")
+        verified.pop(str(file_path), None)
+        return False
+    # Skip re-hashing if size and mtime are unchanged since the last successful verification
+    if is_verified(verified.get(str(file_path)), stat, expected_hash):
+        logger.info(f"Cached hash verification hit for existing file: {file_path.name}")
+        return True
+    verified.pop(str(file_path), None)
+    if expected_size is not None and stat.st_size != expected_size:
+        # Wrong size can't hash correctly, go straight to resuming
+        logger.warning(f"Size mismatch for existing file: {file_path.name} ({stat.st_size} != {expected_size}), "
+                       f"attempting to resume download")
+        return False
+    return None
+
+def verify_existing(url: str, file_path: Path, expected_hash: str, verified: dict,
+                    download_executor: ThreadPoolExecutor) -> Optional[Future]:
+    """Fully hash an existing file, queueing a download if it doesn't match."""
+    if verify_hash(str(file_path), expected_hash):
+        verified[str(file_path)] = verified_entry(file_path, expected_hash)
+        logger.info(f"Hash verified for existing file: {file_path.name}")
+        return None
+    logger.warning(f"Hash mismatch for existing file: {file_path.name}, attempting to resume download")
+    return download_executor.submit(download_model, url, file_path, expected_hash, verified)
+
+def download_model(url: str, file_path: Path, expected_hash: str, verified: dict):
+    """Download a model and check the hash computed while streaming it."""
+    logger.info(f"Downloading {url} to {file_path}")
+    algorithm, digest = parse_hash(expected_hash)
+    actual_hash = download_file(url, str(file_path), algorithm)
+    
+    # Verify hash (computed during download, no second read of the file)
+    if actual_hash.lower() != digest:
+        # Remove file if hash verification fails
+        file_path.unlink()
+        raise RuntimeError(f"Hash verification failed for downloaded file: {file_path.name}")
+    
+    verified[str(file_path)] = verified_entry(file_path, expected_hash)
+    logger.info(f"Successfully downloaded and verified: {file_path.name}")
+
 def main():
     # Check environment variable
     model_cache_path = os.getenv('MODEL_CACHE_PATH')
@@ -173,37 +657,49 @@ def main():
     # Parse models file
     models = parse_models_file('models.txt')
     
-    # Process each model
-    for model_type, url, filename, expected_hash in models:
-        # Get correct folder name (handling singular/plural)
-        folder_name = get_folder_name(model_type, comfy_folders)
-        
-        # Create type-specific subdirectory
-        model_dir = cache_path / folder_name
-        model_dir.mkdir(exist_ok=True)
-        
-        file_path = model_dir / filename
-        
-        # Check if file exists and hash matches
-        if file_path.exists():
-            logger.info(f"File already exists: {file_path}")
-            if verify_hash(str(file_path), expected_hash):
-                logger.info(f"Hash verified for existing file: {filename}")
-                continue
-            else:
-                logger.warning(f"Hash mismatch for existing file: {filename}, attempting to resume download")
-        
-        # Download file
-        logger.info(f"Downloading {url} to {file_path}")
-        download_file(url, str(file_path))
-        
-        # Verify hash
-        if not verify_hash(str(file_path), expected_hash):
-            # Remove file if hash verification fails
-            file_path.unlink()
-            raise RuntimeError(f"Hash verification failed for downloaded file: {filename}")
-        
-        logger.info(f"Successfully downloaded and verified: {filename}")
+    if not models:
+        return
+
+    # Number of concurrent downloads, tunable for high-latency links
+    max_workers = int(os.getenv('MAX_DOWNLOAD_WORKERS', '8'))
+    if max_workers < 1:
+        raise RuntimeError("MAX_DOWNLOAD_WORKERS must be at least 1")
+
+    verified = load_verified(cache_path)
+
+    # Downloads (network bound) and full hashes of existing files (disk bound) run on
+    # separate pools, so verifying one file never holds up downloading another
+    try:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(models))) as download_executor, \
+                ThreadPoolExecutor(max_workers=VERIFY_WORKERS) as verify_executor:
+            verify_futures = []
+            download_futures = []
+            seen_paths = set()
+            for model_type, url, filename, expected_hash, expected_size in models:
+                file_path = get_model_path(model_type, filename, cache_path, comfy_folders)
+                # Two entries writing the same file concurrently would corrupt it; keep the first
+                if file_path in seen_paths:
+                    logger.error(f"Skipping duplicate entry for {file_path}: {model_type} {url}")
+                    continue
+                seen_paths.add(file_path)
+                status = check_existing(file_path, expected_hash, expected_size, verified)
+                if status is None:
+                    verify_futures.append(verify_executor.submit(
+                        verify_existing, url, file_path, expected_hash, verified, download_executor))
+                elif not status:
+                    download_futures.append(download_executor.submit(
+                        download_model, url, file_path, expected_hash, verified))
+
+            # Existing files that fail verification come back as queued downloads
+            for future in as_completed(verify_futures):
+                download_future = future.result()
+                if download_future is not None:
+                    download_futures.append(download_future)
+            for future in as_completed(download_futures):
+                future.result()
+    finally:
+        # Persist whatever was verified this cycle, even if another model failed
+        save_verified(cache_path, verified)
 
 # Global flag for handling graceful shutdown
 running = True